@@ -38,25 +38,25 @@ The next agent will construct paths like: {base_dir}/parts/{filename}""",
 )
 
 
-# 2) Part transcriber - transcribes each part via video_transcriber_server MCP
+# 2) Part transcriber - transcribes all parts concurrently via video_transcriber_server MCP
 @fast.agent(
     name="part_transcriber",
     instruction="""You are a transcription orchestrator.
 
 Given the manifest/parts info from video_preparer:
 
-1. For each part in the parts list:
-   - Get the full video path: {base_dir}/parts/{filename}
-   - Call the `transcribe_video_file` tool with that full path
-   - Save the transcript to {base_dir}/transcripts/part_{index}.json
+1. Call the `transcribe_all_parts` tool once with the manifest (base_dir and parts).
+   It transcribes all parts concurrently and saves each one to
+   {base_dir}/transcripts/part_{index}.json.
 
-2. After all parts are transcribed, combine them into one chronological transcript.
+2. Combine the returned transcripts, in index order, into one chronological transcript.
+   If a part's transcript starts with "Error:", note the gap instead of inventing content.
 
 3. Output the combined transcript.
 4. IMPORTANT: At the very end of your response, output a separate line: "Base Directory: {base_dir}"
 
-Example: If base_dir is "/path/to/youtube_data/my-video" and filename is "my-video_part_000.mp4",
-call transcribe_video_file with "/path/to/youtube_data/my-video/parts/my-video_part_000.mp4".""",
+Example: If base_dir is "/path/to/youtube_data/my-video", call transcribe_all_parts with
+{"base_dir": "/path/to/youtube_data/my-video", "parts": [{"index": 0, "filename": "my-video_part_000.mp4"}, ...]}.""",
     servers=["video_transcriber_server", "filesystem"],
 )
 
@@ -1,18 +1,27 @@
 """Video Transcriber MCP Server
 
-Exposes transcriber tool that receives video file paths and transcribes them.
+Exposes transcriber tools that receive video file paths and transcribe them.
 """
 
 import asyncio
-import base64
-import mimetypes
+import hashlib
+import json
+import mmap
+import os
+import tempfile
 from pathlib import Path
+from typing import Any
 
+import anyio
 from fast_agent import FastAgent
 from fast_agent.core.logging.logger import get_logger
+from fast_agent.llm.model_factory import ModelFactory
+from fast_agent.llm.provider_types import Provider
 from fast_agent.types import PromptMessageExtended, RequestParams, text_content
 from fastmcp import FastMCP
-from mcp.types import BlobResourceContents, EmbeddedResource
+from google import genai
+from google.genai import types
+from mcp.types import ResourceLink
 
 # Initialize logger
 logger = get_logger(__name__)
@@ -23,84 +32,477 @@ mcp = FastMCP(name="VideoTranscriberServer")
 # Initialize FastAgent for LLM capabilities
 fast = FastAgent("InternalTranscriber")
 
+# Max number of parts sent to Gemini at once (keep under the model's RPM limit)
+TRANSCRIBE_CONCURRENCY = int(os.environ.get("TRANSCRIBER_CONCURRENCY", "4"))
+
+# Seconds between Files API state checks while Gemini processes an upload
+UPLOAD_POLL_SECONDS = 2.0
+
+# Videos with at least this many parts go through the Gemini batch API (0 disables)
+BATCH_MIN_PARTS = int(os.environ.get("TRANSCRIBER_BATCH_MIN_PARTS", "4"))
+
+# Seconds between batch job state checks
+BATCH_POLL_SECONDS = 30.0
+
+# Mime types for the video containers yt-dlp/ffmpeg produce
+_MIME = {
+    ".webm": "video/webm",
+    ".mp4": "video/mp4",
+    ".mkv": "video/x-matroska",
+    ".mov": "video/quicktime",
+}
+
+# fast-agent model string for the internal transcriber (and batch jobs)
+MODEL = os.environ.get("TRANSCRIBER_MODEL", "google.gemini-2.0-flash")
+
+def resolve_gemini_model(model: str) -> str:
+    """
+    Return the bare Gemini model id for a fast-agent model string.
+
+    Uses fast-agent's own parsing, so aliases and provider prefixes resolve
+    the same way they do for the internal agent.
+
+    Raises:
+        ValueError: If the model isn't served by the Google provider (the
+            Files API and batch paths need the Gemini API).
+    """
+    config = ModelFactory.parse_model_string(model)
+    if config.provider != Provider.GOOGLE:
+        raise ValueError(
+            f"TRANSCRIBER_MODEL must be a Google Gemini model, got {model!r} "
+            f"(provider {config.provider.value})"
+        )
+    return config.model_name
+
+# Checked at import so a misconfigured model fails on startup, not mid-batch
+GEMINI_MODEL = resolve_gemini_model(MODEL)
+
+SYSTEM_PROMPT = "You are an expert video transcriber. Provide a detailed timestamped transcript of the video provided."
+
 # Define helper agent
 @fast.agent(
     name="internal_transcriber",
     instruction="INTERNAL USE ONLY - DO NOT USE THIS AGENT DIRECTLY.",
-    model="google.gemini-2.0-flash"
+    model=MODEL
 )
 async def internal_transcriber_func():
     pass
 
-@mcp.tool
-async def transcribe_video_file(video_path_str: str) -> str:
+def get_base_dir() -> Path:
+    """Get the base data directory from env or default."""
+    base = os.environ.get("YOUTUBE_MCP_BASE_DIR", "./youtube_data")
+    path = Path(base).expanduser().resolve()
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def get_cache_dir(kind: str) -> Path:
+    """Get (and create) {base_dir}/_cache/{kind}."""
+    path = get_base_dir() / "_cache" / kind
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def detect_mime_type(video_path: Path) -> str:
+    """Return the video mime type from its suffix, defaulting to mp4."""
+    return _MIME.get(video_path.suffix.lower(), "video/mp4")
+
+def transcribe_prompt(video_path: Path) -> str:
+    """Return the user prompt sent alongside a video."""
+    return f"Transcribe this video file: {video_path.name}. Provide a detailed timestamped transcript."
+
+def transcript_cache_path(video_path: Path, digest: str) -> Path:
     """
-    Transcribe a local video file using an internal multimodal agent.
+    Return the transcript cache file for a part.
+
+    The key covers the part's content hash, the model and both prompts, so
+    changing any of them never serves a transcript made under the old ones.
+    """
+    key = "\0".join([digest, MODEL, SYSTEM_PROMPT, transcribe_prompt(video_path)])
+    name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return get_cache_dir("transcripts") / f"{name}.txt"
+
+def file_sha256(path: Path) -> str:
+    """
+    Return the hex SHA-256 of a file's contents.
+
+    The file is memory-mapped and hashed in one call, so no copy of the
+    video is ever held in a Python bytes object.
+    """
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+def write_text_atomic(path: Path, text: str) -> None:
+    """Write text via a temp file + rename so readers never see a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+# --------- Gemini Files API ---------
+
+def get_genai_client(llm: Any) -> genai.Client:
+    """Build a google.genai client from the same config fast-agent uses for the LLM."""
+    return llm._initialize_google_client()
+
+async def upload_to_gemini(
+    client: genai.Client,
+    video_path: Path,
+    mime_type: str,
+    digest: str | None = None,
+) -> str:
+    """
+    Upload a video via the Gemini Files API and wait until it is usable.
+
+    Uploads are cached by content hash, so re-running the same part reuses the
+    existing file for as long as Gemini keeps it (48 hours).
 
     Args:
-        video_path_str: The absolute path to the local video file.
+        client: The google.genai client.
+        video_path: Path to the local video file.
+        mime_type: The video mime type.
+        digest: SHA-256 of the file, if the caller already computed it.
 
     Returns:
-        str: The generated transcript or an error message prefixed with "Error:".
+        str: The Files API URI of the uploaded video.
+
+    Raises:
+        RuntimeError: If Gemini fails to process the upload.
+    """
+    digest = digest or await asyncio.to_thread(file_sha256, video_path)
+    cache_path = get_cache_dir("uploads") / f"{digest}.json"
+    if cache_path.exists():
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        try:
+            file = await client.aio.files.get(name=cached["name"])
+            if file.state == types.FileState.ACTIVE:
+                logger.info(f"Reusing upload {file.name} for {video_path.name}")
+                return file.uri
+        except Exception as e:
+            logger.info(f"Cached upload for {video_path.name} is gone: {str(e)}")
+
+    file = await client.aio.files.upload(
+        file=str(video_path),
+        config={"mime_type": mime_type},
+    )
+    while file.state == types.FileState.PROCESSING:
+        await asyncio.sleep(UPLOAD_POLL_SECONDS)
+        file = await client.aio.files.get(name=file.name)
+
+    if file.state != types.FileState.ACTIVE:
+        raise RuntimeError(f"Gemini failed to process {video_path.name}: {file.error}")
+
+    write_text_atomic(cache_path, json.dumps({"name": file.name, "uri": file.uri}))
+    return file.uri
+
+# --------- core logic (non-MCP) ---------
+
+async def transcribe_with_llm(llm: Any, client: genai.Client, video_path: Path) -> str:
+    """
+    Transcribe a single video file with an already running LLM.
+
+    Transcripts are cached in {base_dir}/_cache/transcripts by content hash,
+    model and prompt, so an unchanged part is never sent to Gemini twice.
+    History is disabled so the same LLM can serve several parts concurrently.
+
+    Args:
+        llm: The internal_transcriber LLM from a running fast-agent context.
+        client: The google.genai client used to upload the video.
+        video_path: Path to the local video file.
+
+    Returns:
+        str: The generated transcript.
+
+    Raises:
+        FileNotFoundError: If the video file doesn't exist.
     """
-    video_path = Path(video_path_str.strip())
-    
     logger.info(f"Processing video: {video_path}")
 
     if not video_path.exists():
-        logger.error(f"File not found: {video_path}")
-        return f"Error: File not found at {video_path}"
+        raise FileNotFoundError(f"File not found at {video_path}")
 
-    # Read and encode video
-    try:
-        video_bytes = video_path.read_bytes()
-        blob_b64 = base64.b64encode(video_bytes).decode("utf-8")
-        
-        # Detect mime type manually for common video formats to be safe
-        suffix = video_path.suffix.lower()
-        if suffix == ".webm":
-            mime_type = "video/webm"
-        elif suffix == ".mp4":
-            mime_type = "video/mp4"
+    # hashing reads the whole part, so keep it off the event loop
+    digest = await asyncio.to_thread(file_sha256, video_path)
+    cache_path = transcript_cache_path(video_path, digest)
+    if cache_path.exists():
+        logger.info(f"Using cached transcript for {video_path.name}")
+        return cache_path.read_text(encoding="utf-8")
+
+    mime_type = detect_mime_type(video_path)
+
+    # Upload once and point Gemini at the file instead of inlining base64 bytes
+    file_uri = await upload_to_gemini(client, video_path, mime_type, digest)
+
+    # Construct Multimodal Message
+    resource = ResourceLink(
+        type="resource_link",
+        name=video_path.name,
+        uri=file_uri,
+        mimeType=mime_type,
+    )
+
+    prompt_message = PromptMessageExtended(
+        role="user",
+        content=[
+            text_content(transcribe_prompt(video_path)),
+            resource
+        ]
+    )
+
+    result = await llm.generate(
+        [prompt_message],
+        request_params=RequestParams(
+            systemPrompt=SYSTEM_PROMPT,
+            maxTokens=8192,
+            use_history=False,
+        )
+    )
+    transcript = result.last_text()
+    if transcript:
+        await asyncio.to_thread(write_text_atomic, cache_path, transcript)
+    return transcript
+
+async def transcribe_parts_batch(
+    client: genai.Client,
+    video_paths: list[Path],
+) -> list[str | BaseException]:
+    """
+    Transcribe several video files with a single Gemini batch job.
+
+    Parts with a cached transcript are skipped; the rest are uploaded via the
+    Files API and submitted as inlined batch requests referencing the
+    uploaded files.
+
+    Args:
+        client: The google.genai client.
+        video_paths: Paths to the local video files.
+
+    Returns:
+        list: One transcript per path, or the exception that part failed
+            with, in the same order as video_paths.
+    """
+    results: list[str | BaseException | None] = [None] * len(video_paths)
+    existing: list[tuple[int, Path]] = []
+    for i, video_path in enumerate(video_paths):
+        if video_path.exists():
+            existing.append((i, video_path))
         else:
-            mime_type, _ = mimetypes.guess_type(video_path)
-            if not mime_type:
-                mime_type = "video/mp4" # Fallback
-
-        # Construct Multimodal Message
-        resource = EmbeddedResource(
-            type="resource",
-            resource=BlobResourceContents(
-                blob=blob_b64,
-                mimeType=mime_type,
-                uri=video_path.as_uri()
+            results[i] = FileNotFoundError(f"File not found at {video_path}")
+
+    # hash all parts in worker threads so the event loop stays responsive
+    digests = await asyncio.gather(
+        *(asyncio.to_thread(file_sha256, video_path) for _, video_path in existing),
+        return_exceptions=True,
+    )
+
+    pending: list[tuple[int, Path, str]] = []
+    for (i, video_path), digest in zip(existing, digests):
+        if isinstance(digest, BaseException):
+            results[i] = digest
+            continue
+        cache_path = transcript_cache_path(video_path, digest)
+        if cache_path.exists():
+            logger.info(f"Using cached transcript for {video_path.name}")
+            results[i] = cache_path.read_text(encoding="utf-8")
+        else:
+            pending.append((i, video_path, digest))
+
+    if not pending:
+        return results
+
+    semaphore = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+
+    async def upload(video_path: Path, digest: str) -> str:
+        async with semaphore:
+            return await upload_to_gemini(
+                client, video_path, detect_mime_type(video_path), digest
             )
+
+    uploads = await asyncio.gather(
+        *(upload(video_path, digest) for _, video_path, digest in pending),
+        return_exceptions=True,
+    )
+    submitted: list[tuple[int, Path, str]] = []
+    file_uris: list[str] = []
+    for item, file_uri in zip(pending, uploads):
+        if isinstance(file_uri, BaseException):
+            results[item[0]] = file_uri
+        else:
+            submitted.append(item)
+            file_uris.append(file_uri)
+
+    if not submitted:
+        return results
+
+    requests = [
+        {
+            "contents": [{
+                "role": "user",
+                "parts": [
+                    {"text": transcribe_prompt(video_path)},
+                    {"file_data": {
+                        "file_uri": file_uri,
+                        "mime_type": detect_mime_type(video_path),
+                    }},
+                ],
+            }],
+            "config": {
+                "system_instruction": SYSTEM_PROMPT,
+                "max_output_tokens": 8192,
+            },
+        }
+        for (_, video_path, _), file_uri in zip(submitted, file_uris)
+    ]
+
+    running = {
+        types.JobState.JOB_STATE_UNSPECIFIED,
+        types.JobState.JOB_STATE_QUEUED,
+        types.JobState.JOB_STATE_PENDING,
+        types.JobState.JOB_STATE_RUNNING,
+        types.JobState.JOB_STATE_CANCELLING,
+    }
+    try:
+        job = await client.aio.batches.create(
+            model=GEMINI_MODEL,
+            src=requests,
+            config={"display_name": f"transcribe-{video_paths[0].stem}"},
         )
-        
-        prompt_message = PromptMessageExtended(
-            role="user",
-            content=[
-                text_content(f"Transcribe this video file: {video_path.name}. Provide a detailed timestamped transcript."),
-                resource
-            ]
-        )
+        logger.info(f"Submitted batch job {job.name} for {len(requests)} parts")
+
+        try:
+            while job.state in running:
+                await asyncio.sleep(BATCH_POLL_SECONDS)
+                job = await client.aio.batches.get(name=job.name)
+        except asyncio.CancelledError:
+            # don't leave an abandoned job running (and billed) on Gemini's side
+            logger.info(f"Cancelling batch job {job.name}")
+            try:
+                await asyncio.shield(client.aio.batches.cancel(name=job.name))
+            except Exception as e:
+                logger.error(f"Failed to cancel batch job {job.name}: {str(e)}")
+            raise
+
+        if job.state != types.JobState.JOB_STATE_SUCCEEDED:
+            raise RuntimeError(f"Batch job {job.name} ended in {job.state}: {job.error}")
+    except Exception as e:
+        # only the parts in the job failed; cached and earlier errors stand
+        logger.error(f"Batch transcription failed: {str(e)}")
+        for i, _, _ in submitted:
+            results[i] = e
+        return results
+
+    responses = job.dest.inlined_responses or []
+    for (i, video_path, digest), response in zip(submitted, responses):
+        if response.error or not response.response:
+            results[i] = RuntimeError(f"Batch request for {video_path.name} failed: {response.error}")
+            continue
+        transcript = response.response.text or ""
+        if transcript:
+            await asyncio.to_thread(
+                write_text_atomic, transcript_cache_path(video_path, digest), transcript
+            )
+        results[i] = transcript
+    for i, video_path, _ in submitted[len(responses):]:
+        results[i] = RuntimeError(f"Batch job returned no response for {video_path.name}")
+    return results
+
+# --------- MCP tools ---------
+
+@mcp.tool
+async def transcribe_video_file(video_path_str: str) -> str:
+    """
+    Transcribe a local video file using an internal multimodal agent.
+
+    Args:
+        video_path_str: The absolute path to the local video file.
 
+    Returns:
+        str: The generated transcript or an error message prefixed with "Error:".
+    """
+    video_path = Path(video_path_str.strip())
+
+    try:
         async with fast.run() as app_ctx:
-             llm = app_ctx.internal_transcriber.llm
-             
-             result = await llm.generate(
-                 [prompt_message],
-                 request_params=RequestParams(
-                     systemPrompt="You are an expert video transcriber. Provide a detailed timestamped transcript of the video provided.",
-                     maxTokens=8192
-                 )
-             )
-             return result.last_text()
-             
+            llm = app_ctx.internal_transcriber.llm
+            return await transcribe_with_llm(llm, get_genai_client(llm), video_path)
     except Exception as e:
          logger.error(f"Transcription failed: {str(e)}")
          return f"Error: {str(e)}"
 
+@mcp.tool
+async def transcribe_all_parts(manifest: dict) -> dict:
+    """
+    Transcribe every part of a prepared video concurrently.
+
+    Each transcript is saved to {base_dir}/transcripts/part_{index}.json as
+    soon as it completes. Videos with BATCH_MIN_PARTS or more parts are sent
+    as one Gemini batch job instead of individual requests.
+
+    Args:
+        manifest: The prepare_youtube_video result (needs base_dir and parts).
+
+    Returns:
+        dict: base_dir and one entry per part, in chronological order, holding
+            either its transcript or an error message prefixed with "Error:".
+    """
+    base_dir = Path(manifest["base_dir"])
+    parts = sorted(manifest.get("parts", []), key=lambda p: p["index"])
+    transcripts_dir = base_dir / "transcripts"
+    transcripts_dir.mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+
+    async def save_part(part: dict, transcript: str) -> None:
+        # write off the event loop so sibling parts keep streaming
+        out_path = anyio.Path(transcripts_dir / f"part_{part['index']}.json")
+        await out_path.write_text(
+            json.dumps({**part, "transcript": transcript}, indent=2),
+            encoding="utf-8",
+        )
+
+    async with fast.run() as app_ctx:
+        llm = app_ctx.internal_transcriber.llm
+        client = get_genai_client(llm)
+
+        if BATCH_MIN_PARTS and len(parts) >= BATCH_MIN_PARTS:
+            results = await transcribe_parts_batch(
+                client, [base_dir / "parts" / p["filename"] for p in parts]
+            )
+            await asyncio.gather(*(
+                save_part(part, result)
+                for part, result in zip(parts, results)
+                if isinstance(result, str)
+            ))
+        else:
+            async def transcribe_part(part: dict) -> str:
+                async with semaphore:
+                    transcript = await transcribe_with_llm(
+                        llm, client, base_dir / "parts" / part["filename"]
+                    )
+                await save_part(part, transcript)
+                return transcript
+
+            results = await asyncio.gather(
+                *(transcribe_part(p) for p in parts),
+                return_exceptions=True,
+            )
+
+    transcripts = []
+    for part, result in zip(parts, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Transcription of part {part['index']} failed: {str(result)}")
+            result = f"Error: {str(result)}"
+        transcripts.append({
+            "index": part["index"],
+            "filename": part["filename"],
+            "transcript": result,
+        })
+    return {"base_dir": str(base_dir), "transcripts": transcripts}
+
 if __name__ == "__main__":
     # Use mcp.run() with stdio transport
     mcp.run(transport="stdio")
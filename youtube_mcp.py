@@ -1,17 +1,22 @@
 from __future__ import annotations
 
+import bisect
+import functools
 import hashlib
-import json
 import logging
 import math
 import os
 import re
+import shutil
 import subprocess
 import sys
-from dataclasses import asdict, dataclass
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Any
 
+import orjson
 from fastmcp import FastMCP
 
 # Initialize logger
@@ -19,6 +24,19 @@ logger = logging.getLogger(__name__)
 
 mcp = FastMCP(name="YouTubeVisionTranscriber")
 
+# maps every UTF-8 byte except [a-z0-9] to "-" so slugify needs one regex pass
+_SLUG_TABLE = bytes(
+    b if chr(b) in "abcdefghijklmnopqrstuvwxyz0123456789" else ord("-")
+    for b in range(256)
+)
+_DASH_RE = re.compile(r"-+")
+
+# Parallel compact_part encodes; libx264 already uses every core on its own
+COMPACT_WORKERS = 2
+
+# Seconds a cached `yt-dlp -J` result stays valid
+META_CACHE_TTL = int(os.environ.get("YOUTUBE_MCP_META_TTL", "86400"))
+
 
 def get_base_dir() -> Path:
     """
@@ -43,22 +61,28 @@ def slugify(title: str) -> str:
     - keep alnum, dash
     - spaces -> dash
     - strip leading/trailing dashes
-    - append 4-char MD5 hash of original title for collision resistance
+    - append 4-char BLAKE2b hash of original title for collision resistance
     
     Args:
         title: The original video title.
         
     Returns:
         str: A slugified string suitable for filenames.
+        
+    Examples:
+        >>> slugify("Hello, World!").rsplit("-", 1)[0]
+        'hello-world'
+        >>> slugify("Café @ 9am (Live)").rsplit("-", 1)[0]
+        'caf-9am-live'
     """
     clean_title = title.strip().lower()
-    # replace @, (), etc. with space then normalize
-    clean_title = re.sub(r"[^a-z0-9]+", "-", clean_title)
-    clean_title = re.sub(r"-+", "-", clean_title)
+    # replace @, (), non-ASCII, etc. with dashes then collapse runs
+    clean_title = clean_title.encode("utf-8").translate(_SLUG_TABLE).decode("ascii")
+    clean_title = _DASH_RE.sub("-", clean_title)
     base_slug = clean_title.strip("-") or "video"
     
     # 4 char hash of original title for collision resistance
-    hash_suffix = hashlib.md5(title.encode("utf-8")).hexdigest()[:4]
+    hash_suffix = hashlib.blake2b(title.encode("utf-8"), digest_size=2).hexdigest()
     
     return f"{base_slug}-{hash_suffix}"
 
@@ -76,28 +100,170 @@ def run_cmd(args: list[str]) -> None:
     )
     logger.info("Command %s output:\n%s", " ".join(args), proc.stdout)
 
-def probe_duration(input_path: Path) -> float:
+@functools.lru_cache(maxsize=64)
+def _probe_cached(path: str, mtime_ns: int, size: int) -> dict[str, Any]:
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-print_format", "json",
+            "-show_format", "-show_streams",
+            path,
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return orjson.loads(result.stdout)
+
+def probe(input_path: Path) -> dict[str, Any]:
     """
-    Return video duration in seconds using ffprobe.
+    Return ffprobe format and stream info for a video.
+    
+    Results are cached per file (path, mtime and size), so repeated lookups
+    on the same file cost a single ffprobe run.
     
     Args:
         input_path: Path to the video file.
         
     Returns:
-        float: Duration in seconds.
+        dict: The parsed ffprobe JSON ("format" and "streams").
+    """
+    st = input_path.stat()
+    return _probe_cached(str(input_path), st.st_mtime_ns, st.st_size)
+
+def probe_keyframes(input_path: Path) -> list[float]:
+    """
+    Return keyframe timestamps of the first video stream, in seconds.
+    
+    Only packet headers are read (no decoding), and timestamps are made
+    relative to the container start so they line up with ffmpeg -ss.
+    
+    Args:
+        input_path: Path to the video file.
+        
+    Returns:
+        list[float]: Sorted keyframe times; empty if there is no video stream.
     """
     result = subprocess.run(
         [
             "ffprobe", "-v", "error",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
+            "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,flags:format=start_time",
+            "-of", "csv",
             str(input_path),
         ],
         check=True,
         capture_output=True,
         text=True,
     )
-    return float(result.stdout.strip())
+    offset = 0.0
+    keyframes = []
+    for line in result.stdout.splitlines():
+        section, _, fields = line.partition(",")
+        if section == "format":
+            offset = float(fields) if fields not in ("", "N/A") else 0.0
+            continue
+        pts_time, _, flags = fields.partition(",")
+        if section == "packet" and flags.startswith("K") and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    return sorted(k - offset for k in keyframes)
+
+def snap_to_keyframes(
+    targets: list[float],
+    keyframes: list[float],
+    duration: float | None = None,
+) -> list[float]:
+    """
+    Move each split point to its nearest keyframe, dropping duplicates.
+    
+    Args:
+        targets: Desired split times in seconds (excluding 0).
+        keyframes: Sorted keyframe times in seconds.
+        duration: Video duration; split points at or past it are dropped.
+        
+    Returns:
+        list[float]: Increasing split times, all after 0 (and before duration).
+        
+    Examples:
+        >>> snap_to_keyframes([10.0, 20.0], [0.0, 4.0, 8.0, 12.0, 21.0])
+        [8.0, 21.0]
+        >>> snap_to_keyframes([1.0, 4.0, 6.0], [0.0, 5.0, 10.0])
+        [5.0]
+        >>> snap_to_keyframes([5.0], [])
+        [5.0]
+    """
+    if not keyframes:
+        return targets
+    snapped: list[float] = []
+    for target in targets:
+        i = bisect.bisect_left(keyframes, target)
+        nearby = keyframes[max(i - 1, 0):i + 1]
+        point = min(nearby, key=lambda k: abs(k - target))
+        if duration is not None and point >= duration:
+            continue
+        if point > 0 and (not snapped or point > snapped[-1]):
+            snapped.append(point)
+    return snapped
+
+def extract_range(
+    input_path: Path,
+    start: float,
+    length: float | None,
+    out_path: Path,
+) -> None:
+    """
+    Copy `length` seconds of a video starting at keyframe `start` into out_path.
+    
+    A length of None copies through to the end of the file.
+    
+    Seeking before -i makes ffmpeg jump straight to the keyframe instead of
+    demuxing everything up to `start`, and the output timestamps restart
+    at zero. The small slack keeps rounding in printed pts_time values from
+    landing on the previous keyframe.
+    
+    ffmpeg writes to a temporary name that is then renamed over out_path,
+    so an existing out_path (e.g. a part_000 hardlinked to the original
+    download by an earlier run) is replaced rather than truncated in place.
+    """
+    tmp_path = out_path.with_name(f"{out_path.stem}.tmp{out_path.suffix}")
+    try:
+        run_cmd([
+            "ffmpeg", "-y",
+            "-ss", str(start + 0.001 if start else 0),
+            "-i", str(input_path),
+            *(["-t", str(length)] if length is not None else []),
+            "-c", "copy",
+            "-map", "0",
+            "-avoid_negative_ts", "make_zero",
+            str(tmp_path),
+        ])
+        os.replace(tmp_path, out_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def compact_part(part_path: Path) -> Path:
+    """
+    Re-encode a part at 1 FPS with low-bitrate mono audio for upload.
+    
+    Gemini samples video at about 1 FPS, so the extra frames in the
+    original only cost upload bandwidth.
+    
+    Args:
+        part_path: Path to the stream-copied part.
+        
+    Returns:
+        Path: The {stem}_small.mp4 file written next to the part.
+    """
+    out_path = part_path.with_name(f"{part_path.stem}_small.mp4")
+    run_cmd([
+        "ffmpeg", "-y",
+        "-i", str(part_path),
+        "-vf", "fps=1",
+        "-c:v", "libx264", "-crf", "28", "-preset", "veryfast",
+        "-c:a", "aac", "-b:a", "64k", "-ac", "1",
+        str(out_path),
+    ])
+    return out_path
 
 def get_file_size_mb(path: Path) -> float:
     """Return file size in MB."""
@@ -113,6 +279,15 @@ class PartInfo:
     start_seconds: float
     end_seconds: float
 
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "index": self.index,
+            "filename": self.filename,
+            "size_mb": self.size_mb,
+            "start_seconds": self.start_seconds,
+            "end_seconds": self.end_seconds,
+        }
+
 @dataclass
 class VideoManifest:
     slug: str
@@ -122,6 +297,7 @@ class VideoManifest:
     original_video: str
     part_size_mb: int
     parts: list[PartInfo]
+    compact_parts: bool = False
 
     def to_dict(self) -> dict[str, Any]:
         return {
@@ -131,7 +307,8 @@ class VideoManifest:
             "base_dir": self.base_dir,
             "original_video": self.original_video,
             "part_size_mb": self.part_size_mb,
-            "parts": [asdict(p) for p in self.parts],
+            "compact_parts": self.compact_parts,
+            "parts": [p.to_dict() for p in self.parts],
         }
 
 # --------- core logic (non-MCP) ---------
@@ -177,6 +354,8 @@ def split_video_into_parts(
     video_path: Path,
     slug: str,
     part_mb: int,
+    duration: float | None = None,
+    compact: bool = False,
 ) -> list[PartInfo]:
     """
     Split video into chunks of approximately part_mb.
@@ -185,6 +364,10 @@ def split_video_into_parts(
         video_path: Path to the source video.
         slug: Video slug.
         part_mb: Target size for each part in MB.
+        duration: Approximate duration in seconds if already known, used
+            only to size the parts of a video that fits in one.
+        compact: Also write a 1 FPS low-bitrate copy of each part and list
+            that one in the manifest (see compact_part).
         
     Returns:
         list[PartInfo]: List of created video parts.
@@ -193,46 +376,75 @@ def split_video_into_parts(
     parts_dir.mkdir(exist_ok=True)
 
     total_size_mb = get_file_size_mb(video_path)
-    duration = probe_duration(video_path)
+    if total_size_mb <= part_mb and duration:
+        duration = float(duration)
+    else:
+        # splitting needs the real length: yt-dlp's is whole seconds only
+        fmt = probe(video_path)["format"]
+        duration = float(fmt["duration"])
+        bit_rate = float(fmt.get("bit_rate") or 0)
+        if bit_rate <= 0:
+            bit_rate = total_size_mb * 8 * 1024 * 1024 / duration
 
     if total_size_mb <= part_mb:
-        # No need to split
+        # No need to split: hardlink the original (fall back to a plain copy)
         out_path = parts_dir / f"{slug}_part_000.mp4"
-        run_cmd([
-            "ffmpeg", "-y",
-            "-i", str(video_path),
-            "-c", "copy",
-            str(out_path),
-        ])
+        out_path.unlink(missing_ok=True)
+        try:
+            os.link(video_path, out_path)
+        except OSError:
+            shutil.copy2(video_path, out_path)
+        if compact:
+            out_path = compact_part(out_path)
         size_mb = get_file_size_mb(out_path)
         return [PartInfo(0, out_path.name, size_mb, 0.0, duration)]
 
-    # naive proportional split: assume constant bitrate
-    num_parts = math.ceil(total_size_mb / part_mb)
+    # size parts from the container bitrate, then even them out
+    max_segment_time = part_mb * 8 * 1024 * 1024 / bit_rate
+    num_parts = math.ceil(duration / max_segment_time)
     segment_time = duration / num_parts
 
-    pattern = str(parts_dir / f"{slug}_part_%03d.mp4")
+    # cut only on keyframes so each part's start/end is exact
+    splits = snap_to_keyframes(
+        [idx * segment_time for idx in range(1, num_parts)],
+        probe_keyframes(video_path),
+        duration,
+    )
+    starts = [0.0, *splits]
+    ends = [*splits, duration]
+
+    # with -c copy every range is independent, so extract them in parallel;
+    # threads are enough since each one just waits on its ffmpeg process
+    chunks = [
+        (idx, start, end, parts_dir / f"{slug}_part_{idx:03d}.mp4")
+        for idx, (start, end) in enumerate(zip(starts, ends))
+    ]
+    last = len(chunks) - 1
+    with ThreadPoolExecutor(max_workers=min(len(chunks), os.cpu_count() or 1)) as pool:
+        futures = [
+            # the last range runs to EOF so nothing past `duration` is lost
+            pool.submit(
+                extract_range, video_path, start,
+                None if idx == last else end - start, out_path,
+            )
+            for idx, start, end, out_path in chunks
+        ]
+        for future in futures:
+            future.result()
+    part_files = [out_path for *_, out_path in chunks]
 
-    run_cmd([
-        "ffmpeg", "-y",
-        "-i", str(video_path),
-        "-c", "copy",
-        "-map", "0",
-        "-f", "segment",
-        "-segment_time", str(segment_time),
-        pattern,
-    ])
+    # re-encoding is CPU-bound, so it gets its own small pool
+    if compact:
+        with ThreadPoolExecutor(max_workers=COMPACT_WORKERS) as pool:
+            part_files = list(pool.map(compact_part, part_files))
 
-    part_files = sorted(parts_dir.glob(f"{slug}_part_*.mp4"))
     parts: list[PartInfo] = []
-    for idx, f in enumerate(part_files):
-        size_mb = get_file_size_mb(f)
-        start = idx * segment_time
-        end = min(duration, (idx + 1) * segment_time)
+    for (idx, start, end, _), out_path in zip(chunks, part_files):
+        size_mb = get_file_size_mb(out_path)
         parts.append(
             PartInfo(
                 index=idx,
-                filename=f.name,
+                filename=out_path.name,
                 size_mb=round(size_mb, 2),
                 start_seconds=round(start, 2),
                 end_seconds=round(end, 2),
@@ -246,8 +458,7 @@ def write_manifest(
 ) -> None:
     """Write the video manifest to disk."""
     path = video_dir / "manifest.json"
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(manifest.to_dict(), f, indent=2)
+    path.write_bytes(orjson.dumps(manifest.to_dict(), option=orjson.OPT_INDENT_2))
 
 def load_manifest(slug: str) -> VideoManifest:
     """
@@ -267,7 +478,7 @@ def load_manifest(slug: str) -> VideoManifest:
     path = video_dir / "manifest.json"
     if not path.exists():
         raise FileNotFoundError(f"Manifest not found for slug {slug}")
-    data = json.loads(path.read_text(encoding="utf-8"))
+    data = orjson.loads(path.read_bytes())
     parts = [
         PartInfo(**p_dict) for p_dict in data.get("parts", [])
     ]
@@ -279,21 +490,104 @@ def load_manifest(slug: str) -> VideoManifest:
         original_video=data["original_video"],
         part_size_mb=data["part_size_mb"],
         parts=parts,
+        compact_parts=data.get("compact_parts", False),
     )
 
+def fetch_metadata(url: str) -> dict[str, Any]:
+    """
+    Return `yt-dlp -J` metadata for a URL.
+    
+    Results are cached in {base_dir}/_cache/meta for META_CACHE_TTL seconds.
+    
+    Args:
+        url: YouTube video URL.
+        
+    Returns:
+        dict: The parsed yt-dlp JSON.
+    """
+    cache_dir = get_base_dir() / "_cache" / "meta"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+    if path.exists() and time.time() - path.stat().st_mtime < META_CACHE_TTL:
+        return orjson.loads(path.read_bytes())
+
+    meta = subprocess.run(
+        ["yt-dlp", "-J", url],
+        check=True,
+        capture_output=True,
+    )
+    path.write_bytes(meta.stdout)
+    return orjson.loads(meta.stdout)
+
+def find_cached_manifest(
+    url: str,
+    part_mb: int,
+    compact: bool,
+) -> VideoManifest | None:
+    """
+    Find an earlier run of the same URL and options whose files still exist.
+    
+    Args:
+        url: YouTube video URL.
+        part_mb: Target size for video parts in MB.
+        compact: Whether compacted parts are wanted.
+        
+    Returns:
+        VideoManifest | None: The manifest, or None if the video must be prepared.
+    """
+    for path in get_base_dir().glob("*/manifest.json"):
+        try:
+            manifest = load_manifest(path.parent.name)
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+        if (
+            manifest.youtube_url != url
+            or manifest.part_size_mb != part_mb
+            or manifest.compact_parts != compact
+        ):
+            continue
+        video_dir = Path(manifest.base_dir)
+        if not (video_dir / manifest.original_video).exists():
+            continue
+        if all((video_dir / "parts" / p.filename).exists() for p in manifest.parts):
+            return manifest
+    return None
+
+def manifest_result(manifest: VideoManifest) -> dict[str, Any]:
+    """Build the prepare_youtube_video response for a manifest."""
+    parts_resources = [
+        f"video://{manifest.slug}/part/{p.index}" for p in manifest.parts
+    ]
+    return {
+        "slug": manifest.slug,
+        "title": manifest.title,
+        "youtube_url": manifest.youtube_url,
+        "base_dir": manifest.base_dir,
+        "parts": [p.to_dict() for p in manifest.parts],
+        "manifest_resource": f"video://{manifest.slug}/manifest",
+        "parts_resources": parts_resources,
+    }
+
 # --------- MCP tools ---------
 
 @mcp.tool
 def prepare_youtube_video(
     url: str,
     part_mb: int = 15,
+    compact: bool = False,
 ) -> dict:
     """
     Download a YouTube video, normalize the filename, split into parts.
     
+    If the same URL was already prepared with the same options and its
+    files are still on disk, the existing manifest is returned as is.
+    
     Args:
         url: The YouTube URL.
         part_mb: Target size for video parts in MB.
+        compact: Optionally re-encode parts at 1 FPS with low-bitrate audio,
+            which shrinks the upload to Gemini at the cost of local CPU time
+            (originals stay in parts/).
         
     Returns:
         dict: Processed video metadata including resources.
@@ -301,14 +595,13 @@ def prepare_youtube_video(
     try:
         base_dir = get_base_dir()
 
+        cached = find_cached_manifest(url, part_mb, compact)
+        if cached:
+            logger.info("Reusing prepared video %s", cached.slug)
+            return manifest_result(cached)
+
         # 1) Get title via yt-dlp JSON
-        meta = subprocess.run(
-            ["yt-dlp", "-J", url],
-            check=True,
-            capture_output=True,
-            text=True,
-        )
-        meta_json = json.loads(meta.stdout)
+        meta_json = fetch_metadata(url)
         title = meta_json.get("title") or "youtube-video"
         slug = slugify(title)
 
@@ -318,7 +611,14 @@ def prepare_youtube_video(
         video_path = download_youtube(url, slug, video_dir)
 
         # 3) split
-        parts = split_video_into_parts(video_path, slug, part_mb=part_mb)
+        # yt-dlp's duration spares an ffprobe when the video needs no split
+        parts = split_video_into_parts(
+            video_path,
+            slug,
+            part_mb=part_mb,
+            duration=meta_json.get("duration"),
+            compact=compact,
+        )
 
         # 4) write manifest
         manifest = VideoManifest(
@@ -329,21 +629,11 @@ def prepare_youtube_video(
             original_video=video_path.name,
             part_size_mb=part_mb,
             parts=parts,
+            compact_parts=compact,
         )
         write_manifest(manifest, video_dir)
 
-        parts_resources = [
-            f"video://{slug}/part/{p.index}" for p in parts
-        ]
-        return {
-            "slug": slug,
-            "title": title,
-            "youtube_url": url,
-            "base_dir": str(video_dir),
-            "parts": [asdict(p) for p in parts],
-            "manifest_resource": f"video://{slug}/manifest",
-            "parts_resources": parts_resources,
-        }
+        return manifest_result(manifest)
     except Exception as e:
          logger.error(f"Preparation failed: {str(e)}")
          raise
@@ -362,7 +652,7 @@ def video_part(slug: str, index: int) -> dict:
     manifest = load_manifest(slug)
     for p in manifest.parts:
         if p.index == index:
-            d = asdict(p)
+            d = p.to_dict()
             d["file_path"] = str(
                 Path(manifest.base_dir) / "parts" / p.filename
             )